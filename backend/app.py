@@ -1,19 +1,73 @@
-from fastapi import FastAPI, Header
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse
-from pydantic import BaseModel, Field
-from typing import List, Literal, Optional
-import sqlite3, os, datetime, csv, io, json
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import Annotated, List, Literal, Optional
+from aiosqlitepool import SQLiteConnectionPool
+import aiosqlite
+import msgspec
+import orjson
+import asyncio, os, datetime, time, csv, functools, hashlib, json, logging
+
+try:
+    import fcntl  # lock entre workers no boot (indisponível no Windows)
+except ImportError:
+    fcntl = None
 
 
 
 
 # ===== Integração com Google Sheets =====
+# Logs da integração via logging (sem print por pedido): sucesso em DEBUG, desligado por
+# padrão (WARNING); erros continuam indo para o stderr
+log = logging.getLogger("gsheet")
+log.setLevel(logging.WARNING)
+
 GOOGLE_SHEETS_ID = os.getenv("GOOGLE_SHEETS_ID", "")
-print("DEBUG SHEETS ID:", GOOGLE_SHEETS_ID)
+log.debug("SHEETS ID: %s", GOOGLE_SHEETS_ID)
 
 GOOGLE_SERVICE_ACCOUNT_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON", "")
 
+# Credenciais da service account: normalizadas e parseadas (chave RSA) uma única vez, no import
+_CREDS = None
+
+def _init_creds():
+    """Monta _CREDS a partir de GOOGLE_SERVICE_ACCOUNT_JSON, com normalização robusta."""
+    global _CREDS
+    from google.oauth2.service_account import Credentials
+
+    raw = GOOGLE_SERVICE_ACCOUNT_JSON.strip()
+
+    # 1) Garante que é JSON com aspas duplas
+    if raw.startswith("'") and raw.endswith("'"):
+        raw = raw[1:-1]
+    if raw.startswith("“") and raw.endswith("”"):
+        raw = raw[1:-1]
+    if raw.startswith("”") and raw.endswith("“"):
+        raw = raw[1:-1]
+
+    # 2) Tenta decodificar
+    info = json.loads(raw)
+
+    # 3) Normaliza a chave privada: converte \\n -> \n e remove \r
+    pk = info.get("private_key", "")
+    if isinstance(pk, str):
+        # Se veio com as barras literais, converte para quebra real:
+        pk = pk.replace("\\r\\n", "\n").replace("\\n", "\n").replace("\r\n", "\n")
+        info["private_key"] = pk
+
+    # 4) Cria credenciais com o escopo correto do Sheets
+    _CREDS = Credentials.from_service_account_info(
+        info, scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+
+if GOOGLE_SERVICE_ACCOUNT_JSON:
+    try:
+        _init_creds()
+    except Exception as e:
+        log.error("GSHEETS CREDENTIALS ERROR: %r", e)
+
 
 # =====================
 # Configurações gerais
@@ -23,19 +77,72 @@ STRIPE_SECRET = os.getenv("STRIPE_SECRET", "")
 CHECKOUT_SUCCESS_URL = os.getenv("CHECKOUT_SUCCESS_URL", "https://example.com/sucesso")
 CHECKOUT_CANCEL_URL = os.getenv("CHECKOUT_CANCEL_URL", "https://example.com/cancelado")
 
+# Stripe: import e chave configurados uma única vez, fora do caminho das requisições
+# (o checkout em si ainda não existe no MVP; create_order grava checkout_url = None)
+if STRIPE_ENABLED and STRIPE_SECRET:
+    import stripe
+    stripe.api_key = STRIPE_SECRET
+    _STRIPE = stripe
+else:
+    _STRIPE = None
+
 # Banco (use um Disk no Render e a env DB_PATH=/var/data/data.db para persistir)
 DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "data.db"))
 
-app = FastAPI(title="Casa do pão francês — Pedidos API")
+app = FastAPI(title="Casa do pão francês — Pedidos API", default_response_class=ORJSONResponse)
+
+# Limites de payload: corpos gigantes são recusados antes de qualquer parse/validação
+MAX_BODY_BYTES = 64 * 1024
+MAX_ORDER_ITEMS = 50
+MAX_BULK_IDS = 500  # abaixo do limite de variáveis do SQLite (999 em versões antigas)
+
+# ===== Recusa corpos acima de MAX_BODY_BYTES (413) =====
+class LimitBodySize:
+    """Middleware ASGI puro: barra pelo Content-Length e, sem ele (chunked), conta os bytes
+    recebidos e interrompe a leitura assim que passam do limite, sem bufferizar o resto."""
+
+    def __init__(self, app, max_bytes: int = MAX_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.max_bytes:
+                    return await _err(_ERR_BODY_TOO_LARGE, 413)(scope, receive, send)
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # HTTPException: vira 413 pelo handler do app (inclusive em rotas com corpo Pydantic)
+                    raise HTTPException(status_code=413, detail=_ERR_BODY_TOO_LARGE)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Registrado antes do CORS para ficar por dentro dele: o 413 sai com os headers CORS.
+app.add_middleware(LimitBodySize)
 
 # CORS (inclui X-Admin-Token e OPTIONS)
+# FRONTEND_ORIGIN: origem(ns) do frontend separadas por vírgula (ex.: https://casa-pao.vercel.app).
+# Sem a variável, aceita qualquer origem (útil no dev local com index.html aberto via file://).
+FRONTEND_ORIGINS = [o.strip() for o in os.getenv("FRONTEND_ORIGIN", "*").split(",") if o.strip()]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],            # opcional: restrinja ao seu domínio da Vercel
+    allow_origins=FRONTEND_ORIGINS,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["*"],            # o próprio middleware responde o preflight OPTIONS
     allow_headers=["*", "X-Admin-Token"],
     expose_headers=["*"],
+    max_age=86400,                  # navegador reaproveita o preflight por 24h
 )
 
 # ===== Middleware para logar erros e retornar detalhe (diagnóstico) =====
@@ -47,147 +154,295 @@ async def catch_all_exceptions(request, call_next):
         import traceback, sys
         print("### SERVER ERROR ###", file=sys.stderr)
         traceback.print_exc()
-        return JSONResponse({"error": "server", "detail": str(e)}, status_code=500)
+        return ORJSONResponse({"error": "server", "detail": str(e)}, status_code=500)
+
+# ===== Respostas de erro no formato {"error": ...} esperado pelo frontend =====
+# Mensagens fixas têm o corpo serializado uma única vez, no import
+_ERR_EMPTY_CART = "Carrinho vazio"
+_ERR_MODE_MISMATCH = "Produtos incompatíveis com o modo selecionado."
+_ERR_ADDRESS_REQUIRED = "Endereço é obrigatório para entrega."
+_ERR_INVALID_PRODUCT = "Produto inválido"
+_ERR_UNAUTHORIZED = "unauthorized"
+_ERR_INVALID_STATUS = "invalid status"
+_ERR_BODY_TOO_LARGE = f"Requisição muito grande (máx. {MAX_BODY_BYTES // 1024} KB)."
+_ERR_TOO_MANY_ITEMS = f"Máximo de {MAX_ORDER_ITEMS} itens por pedido."
+_ERR_INVALID_IDS = f"Informe de 1 a {MAX_BULK_IDS} pedidos."
+_ERR_BODIES = {msg: orjson.dumps({"error": msg}) for msg in (
+    _ERR_EMPTY_CART, _ERR_MODE_MISMATCH, _ERR_ADDRESS_REQUIRED,
+    _ERR_INVALID_PRODUCT, _ERR_UNAUTHORIZED, _ERR_INVALID_STATUS,
+    _ERR_BODY_TOO_LARGE, _ERR_TOO_MANY_ITEMS, _ERR_INVALID_IDS,
+)}
+
+def _err(msg: str, status_code: int = 400, headers: Optional[dict] = None) -> Response:
+    body = _ERR_BODIES.get(msg) or orjson.dumps({"error": msg})
+    return Response(body, status_code=status_code, headers=headers, media_type="application/json")
+
+@app.exception_handler(HTTPException)
+async def http_exception_handler(request, exc: HTTPException):
+    return _err(exc.detail, exc.status_code, exc.headers)
 
-# ===== OPTIONS catch-all p/ preflight CORS com header custom =====
-@app.options("/{rest_of_path:path}")
-def options_catch_all(rest_of_path: str = ""):
-    return PlainTextResponse("", status_code=200)
 
 # =====================
-# Banco de dados (SQLite)
+# Banco de dados (SQLite assíncrono + pool de conexões)
 # =====================
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-cur = conn.cursor()
-
-# Tabelas base (mínimas); colunas novas serão adicionadas por migrações abaixo
-cur.execute("""
-CREATE TABLE IF NOT EXISTS products(
-  id INTEGER PRIMARY KEY, name TEXT, price REAL
-)""")
-cur.execute("""
-CREATE TABLE IF NOT EXISTS orders(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  customer_name TEXT, customer_phone TEXT, customer_address TEXT,
-  total REAL
-)""")
-cur.execute("""
-CREATE TABLE IF NOT EXISTS order_items(
-  order_id INTEGER, product_id INTEGER, qty INTEGER, price REAL
-)""")
-conn.commit()
 
-# ---- MIGRAÇÕES: adiciona colunas que podem faltar em bancos antigos ----
-def _safe_add_column(table: str, col: str, coltype: str):
-    try:
-        cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} {coltype}")
-        conn.commit()
-    except Exception:
-        pass  # já existe ou não precisa
+# Pool criado no startup; os handlers usam `async with pool.connection() as db`
+pool: Optional[SQLiteConnectionPool] = None
+
+# Catálogo em memória {id: (nome, preço)}; carregado no startup após o re-seed.
+# Nenhuma rota escreve em `products` — se isso mudar, recarregue este cache após a escrita.
+PRODUCTS: dict[int, tuple[str, float]] = {}
+
+# Resposta de GET /products pré-montada junto com o catálogo (corpo JSON + ETag forte)
+_PRODUCTS_BODY: bytes = b"[]"
+_PRODUCTS_ETAG: str = ""
+
+def _set_products(rows):
+    global _PRODUCTS_BODY, _PRODUCTS_ETAG
+    PRODUCTS.clear()
+    PRODUCTS.update({r[0]: (r[1], r[2]) for r in rows})
+    _PRODUCTS_BODY = orjson.dumps([{"id": k, "name": n, "price": p} for k, (n, p) in PRODUCTS.items()])
+    _PRODUCTS_ETAG = '"%s"' % hashlib.sha1(_PRODUCTS_BODY).hexdigest()
 
-_safe_add_column("orders", "checkout_url", "TEXT")
-_safe_add_column("orders", "mode", "TEXT")
-_safe_add_column("orders", "delivery_date", "TEXT")
-_safe_add_column("orders", "status", "TEXT")
+# Versão do esquema, gravada em PRAGMA user_version. Aumente ao mudar tabelas ou colunas.
+SCHEMA_VERSION = 1
 
-# Re-seed dos produtos oficiais (somente os dois corretos)
-cur.execute("DELETE FROM products")
-cur.executemany("INSERT INTO products(id,name,price) VALUES(?,?,?)", [
+# Produtos oficiais (somente os dois corretos); o banco é re-semeado só se divergir daqui
+OFFICIAL_PRODUCTS = [
     (1, "Pacote (10 pães) — retirada na loja — saco a vácuo", 5.00),
     (2, "Entrega — 20 pães (2×10) — saco a vácuo (sexta-feira)", 14.00),
-])
-conn.commit()
+]
+
+# ---- MIGRAÇÕES: adiciona colunas que podem faltar em bancos antigos ----
+async def _safe_add_column(db: aiosqlite.Connection, table: str, cols: set[str], col: str, coltype: str):
+    # Só roda o ALTER se a coluna faltar (cols vem do PRAGMA table_info); sem exceção engolida
+    if col not in cols:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {col} {coltype}")
+        cols.add(col)
+
+async def _connect() -> aiosqlite.Connection:
+    """Abre uma conexão já configurada (WAL, fsync reduzido, cache grande).
+
+    Usada como fábrica do pool: cada conexão nova paga os PRAGMAs uma única vez.
+    Em modo autocommit (isolation_level=None): transações são abertas com BEGIN explícito.
+    O cache de statements preparados é ampliado para que as SQL fixas (constantes do
+    módulo) nunca sejam despejadas e re-parseadas.
+    """
+    db = await aiosqlite.connect(DB_PATH, isolation_level=None, cached_statements=256)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA cache_size=-20000")  # ~20 MB
+    await db.execute("PRAGMA mmap_size=134217728")  # 128 MB
+    db.row_factory = aiosqlite.Row
+    return db
+
+async def _migrate(db: aiosqlite.Connection):
+    # Tabelas base (mínimas); colunas novas são adicionadas pelas migrações abaixo
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS products(
+      id INTEGER PRIMARY KEY, name TEXT, price REAL
+    )""")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS orders(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      customer_name TEXT, customer_phone TEXT, customer_address TEXT,
+      total REAL
+    )""")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS order_items(
+      order_id INTEGER, product_id INTEGER, qty INTEGER, price REAL
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+
+    async with db.execute("PRAGMA table_info(orders)") as cur:
+        cols = {r[1] for r in await cur.fetchall()}
+    await _safe_add_column(db, "orders", cols, "checkout_url", "TEXT")
+    await _safe_add_column(db, "orders", cols, "mode", "TEXT")
+    await _safe_add_column(db, "orders", cols, "delivery_date", "TEXT")
+    await _safe_add_column(db, "orders", cols, "status", "TEXT")
+
+async def _seed_products(db: aiosqlite.Connection):
+    """Re-semeia `products` apenas se divergir de OFFICIAL_PRODUCTS (boot normal não escreve)."""
+    async with db.execute("SELECT id,name,price FROM products ORDER BY id") as cur:
+        existing = [tuple(r) for r in await cur.fetchall()]
+    if existing == OFFICIAL_PRODUCTS:
+        return
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        await db.execute("DELETE FROM products")
+        await db.executemany("INSERT INTO products(id,name,price) VALUES(?,?,?)", OFFICIAL_PRODUCTS)
+        await db.execute("COMMIT")
+    except Exception:
+        await db.execute("ROLLBACK")
+        raise
+
+async def _init_db():
+    """Aplica o esquema uma vez por SCHEMA_VERSION, confere o seed e carrega o catálogo.
+
+    Um flock em `<DB_PATH>.lock` serializa os workers no boot: o primeiro migra e grava
+    o user_version; os demais veem a versão atual e pulam direto para o catálogo.
+    """
+    with open(DB_PATH + ".lock", "w") as lock:  # fechar o arquivo libera o flock
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        db = await _connect()
+        try:
+            async with db.execute("PRAGMA user_version") as cur:
+                (version,) = await cur.fetchone()
+            if version < SCHEMA_VERSION:
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    await _migrate(db)
+                    await db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+                    await db.execute("COMMIT")
+                except Exception:
+                    await db.execute("ROLLBACK")
+                    raise
+
+            await _seed_products(db)
+            _set_products(OFFICIAL_PRODUCTS)
+        finally:
+            await db.close()
+
+@app.on_event("startup")
+async def startup():
+    global pool, _sheets_task
+    await _init_db()
+    pool = SQLiteConnectionPool(_connect)
+    _sheets_task = asyncio.create_task(_sheets_worker())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _sheets_task is not None:
+        # Pede para o worker esvaziar a fila; se estourar o prazo, wait_for o cancela
+        # e o próprio worker loga as linhas descartadas
+        SHEETS_QUEUE.put_nowait(_SHEETS_STOP)
+        try:
+            await asyncio.wait_for(_sheets_task, timeout=SHEETS_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    if pool is not None:
+        await pool.close()
 
 # =====================
 # Modelos
 # =====================
-class ItemIn(BaseModel):
+# Payload do POST /orders (rota mais quente): msgspec valida em C, bem mais barato que Pydantic
+class ItemIn(msgspec.Struct):
     id: int
-    qty: int = Field(ge=1)
+    qty: Annotated[int, msgspec.Meta(ge=1)]
 
-class Customer(BaseModel):
+class Customer(msgspec.Struct):
     nome: str
     telefone: str
     endereco: Optional[str] = ""
 
-class OrderIn(BaseModel):
+class OrderIn(msgspec.Struct):
     customer: Customer
     items: List[ItemIn]
     mode: Literal["pickup", "delivery"]
 
+_ORDER_DECODER = msgspec.json.Decoder(OrderIn)
+
 # =====================
 # Utilidades
 # =====================
+# Dias até a próxima sexta, indexado por weekday() (Monday=0 ... Sunday=6, Friday=4).
+# Tabela em vez de JIT (Numba): o custo de dispatch seria maior que o módulo economizado.
+_DAYS_TO_FRIDAY = (4, 3, 2, 1, 0, 6, 5)
+
 def next_friday(today: Optional[datetime.date] = None) -> datetime.date:
     if today is None:
         today = datetime.date.today()
-    # Monday=0 ... Sunday=6, Friday=4
-    days_ahead = (4 - today.weekday()) % 7
-    return today if days_ahead == 0 else today + datetime.timedelta(days=days_ahead)
+    return today + datetime.timedelta(days=_DAYS_TO_FRIDAY[today.weekday()])
+
+# Próxima sexta (ISO) por data: o resultado só muda à meia-noite
+@functools.lru_cache(maxsize=8)
+def _next_friday_for(today: datetime.date) -> str:
+    return next_friday(today).isoformat()
+
+def next_friday_iso() -> str:
+    return _next_friday_for(datetime.date.today())
 
 # =====================
 # Rotas públicas
 # =====================
 @app.get("/")
-def root():
+async def root():
     return {"ok": True, "service": "Casa do pão francês — Pedidos API"}
 
 @app.get("/products")
-def get_products():
-    rows = cur.execute("SELECT id,name,price FROM products").fetchall()
-    return [{"id": r[0], "name": r[1], "price": r[2]} for r in rows]
+async def get_products(request: Request):
+    headers = {"ETag": _PRODUCTS_ETAG, "Cache-Control": "public, max-age=60"}
+    if request.headers.get("if-none-match") == _PRODUCTS_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(_PRODUCTS_BODY, headers=headers, media_type="application/json")
+
+# Regras por modo:
+# - delivery: somente produto ID 2 (20 pães), endereço obrigatório, entrega na próxima sexta
+# - pickup:   somente produto ID 1 (pacote de 10), sem endereço obrigatório
+_MODE_ALLOWED = {"pickup": 1, "delivery": 2}
+_ADDRESS_REQUIRED = {"pickup": False, "delivery": True}
+
+# SQL fixas do caminho quente: texto idêntico a cada chamada = acerto no cache de statements
+_INSERT_ORDER_SQL = (
+    "INSERT INTO orders(customer_name,customer_phone,customer_address,total,checkout_url,mode,delivery_date,status) "
+    "VALUES(?,?,?,?,?,?,?,?)"
+)
+_INSERT_ITEMS_SQL = "INSERT INTO order_items(order_id,product_id,qty,price) VALUES(?,?,?,?)"
 
 @app.post("/orders")
-def create_order(payload: OrderIn):
+async def create_order(request: Request):
+    body = await request.body()  # LimitBodySize já garante no máximo MAX_BODY_BYTES
+    try:
+        payload = _ORDER_DECODER.decode(body)
+    except msgspec.DecodeError as e:  # inclui ValidationError
+        return _err(str(e), 422)
     if not payload.items:
-        return {"error": "Carrinho vazio"}
+        return _err(_ERR_EMPTY_CART)
+    if len(payload.items) > MAX_ORDER_ITEMS:
+        return _err(_ERR_TOO_MANY_ITEMS)
 
-    # Regras:
-    # - delivery: somente produto ID 2 (20 pães), endereço obrigatório, entrega na próxima sexta
-    # - pickup:   somente produto ID 1 (pacote de 10), sem endereço obrigatório
-    allowed_id = 2 if payload.mode == "delivery" else 1
-    invalid = [it.id for it in payload.items if it.id != allowed_id]
-    if invalid:
-        return {"error": "Produtos incompatíveis com o modo selecionado."}
+    allowed_id = _MODE_ALLOWED[payload.mode]
+    if any(it.id != allowed_id for it in payload.items):
+        return _err(_ERR_MODE_MISMATCH)
 
-    if payload.mode == "delivery":
+    if _ADDRESS_REQUIRED[payload.mode]:
         if not payload.customer.endereco or not payload.customer.endereco.strip():
-            return {"error": "Endereço é obrigatório para entrega."}
-        entrega = next_friday().isoformat()
+            return _err(_ERR_ADDRESS_REQUIRED)
+        entrega = next_friday_iso()
     else:
         entrega = None
 
-    # Preços oficiais do DB
-    ids = tuple({i.id for i in payload.items})
-    qmarks = ",".join(["?"] * len(ids))
-    db_products = {r[0]: (r[1], r[2]) for r in cur.execute(
-        f"SELECT id,name,price FROM products WHERE id IN ({qmarks})", ids
-    ).fetchall()}
-
-    total = 0.0
-    for it in payload.items:
-        if it.id not in db_products:
-            return {"error": "Produto inválido"}
-        total += db_products[it.id][1] * it.qty
-
-    checkout_url = None  # Stripe desligado no MVP
-
-    # Grava pedido
-    cur.execute("""
-        INSERT INTO orders(customer_name,customer_phone,customer_address,total,checkout_url,mode,delivery_date,status)
-        VALUES(?,?,?,?,?,?,?,?)
-    """, (payload.customer.nome, payload.customer.telefone, payload.customer.endereco or "",
-          total, checkout_url, payload.mode, entrega, "pending"))
-    order_id = cur.lastrowid
-
-    for it in payload.items:
-        _, price = db_products[it.id]
-        cur.execute("INSERT INTO order_items(order_id,product_id,qty,price) VALUES(?,?,?,?)",
-                    (order_id, it.id, it.qty, price))
-    conn.commit()
-    # Envia automaticamente para Google Sheets (se configurado)
-    _append_to_gsheet_safe(order_id, payload, db_products, total, entrega)
+    # Preço oficial (cache do catálogo); todos os itens já são allowed_id
+    if allowed_id not in PRODUCTS:
+        return _err(_ERR_INVALID_PRODUCT)
+    _, price = PRODUCTS[allowed_id]
+    total = sum(price * it.qty for it in payload.items)
+
+    checkout_url = None  # Stripe desligado no MVP (ver STRIPE_ENABLED)
+
+    async with pool.connection() as db:
+        # Grava pedido + itens numa única transação (um só commit/fsync)
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            async with db.execute(_INSERT_ORDER_SQL, (
+                payload.customer.nome, payload.customer.telefone, payload.customer.endereco or "",
+                total, checkout_url, payload.mode, entrega, "pending",
+            )) as cur:
+                order_id = cur.lastrowid
+
+            rows = [(order_id, it.id, it.qty, price) for it in payload.items]
+            await db.executemany(_INSERT_ITEMS_SQL, rows)
+            await db.execute("COMMIT")
+        except Exception:
+            await db.execute("ROLLBACK")
+            raise
+
+    # Enfileira para o Google Sheets (se configurado); o envio acontece em segundo plano
+    _append_to_gsheet_safe(order_id, payload, PRODUCTS, total, entrega)
 
 
     return {"order_id": order_id, "total": total, "checkout_url": checkout_url,
@@ -198,71 +453,157 @@ def create_order(payload: OrderIn):
 # =====================
 
 
-def _append_to_gsheet(row):
-    """Adiciona uma linha no Google Sheets com normalização robusta da credencial e logs claros."""
-    print("🚀 Iniciando envio ao Google Sheets...")
-    print("GOOGLE_SHEETS_ID:", GOOGLE_SHEETS_ID[:10], "...")
-    if not GOOGLE_SHEETS_ID or not GOOGLE_SERVICE_ACCOUNT_JSON:
-        print("GSHEETS ERROR: Missing ID or credentials.")
-        return
+def _open_worksheet():
+    """Autoriza (com _CREDS) e abre a primeira aba da planilha.
 
-    try:
-        from google.oauth2.service_account import Credentials
-        import gspread
+    Retorna None se ID/credenciais não estiverem configurados; outras falhas propagam.
+    """
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("🚀 Abrindo Google Sheets... GOOGLE_SHEETS_ID: %s ...", GOOGLE_SHEETS_ID[:10])
+    if not GOOGLE_SHEETS_ID or _CREDS is None:
+        log.error("GSHEETS ERROR: Missing ID or credentials.")
+        return None
 
-        raw = GOOGLE_SERVICE_ACCOUNT_JSON.strip()
-
-        # 1) Garante que é JSON com aspas duplas
-        if raw.startswith("'") and raw.endswith("'"):
-            raw = raw[1:-1]
-        if raw.startswith("“") and raw.endswith("”"):
-            raw = raw[1:-1]
-        if raw.startswith("”") and raw.endswith("“"):
-            raw = raw[1:-1]
-
-        # 2) Tenta decodificar
-        info = json.loads(raw)
-
-        # 3) Normaliza a chave privada: converte \\n -> \n e remove \r
-        pk = info.get("private_key", "")
-        if isinstance(pk, str):
-            # Se veio com as barras literais, converte para quebra real:
-            pk = pk.replace("\\r\\n", "\n").replace("\\n", "\n").replace("\r\n", "\n")
-            info["private_key"] = pk
-
-        # 4) Cria credenciais com o escopo correto do Sheets
-        creds = Credentials.from_service_account_info(
-            info, scopes=["https://www.googleapis.com/auth/spreadsheets"]
-        )
-
-        # 5) Abre planilha e escreve na primeira aba
-        gc = gspread.authorize(creds)
-        print("✅ Autorizado, abrindo planilha...")
-        sh = gc.open_by_key(GOOGLE_SHEETS_ID)
-        print("✅ Planilha aberta:", sh.title)
+    import gspread
 
+    gc = gspread.authorize(_CREDS)
+    log.debug("✅ Autorizado, abrindo planilha...")
+    sh = gc.open_by_key(GOOGLE_SHEETS_ID)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("✅ Planilha aberta: %s", sh.title)
+
+    try:
+        ws = sh.sheet1
+    except Exception:
+        # fallback caso a ordem de abas tenha mudado
+        ws = sh.get_worksheet(0)
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("✅ Aba selecionada: %s", ws.title)
+    return ws
+
+# Aba autorizada reaproveitada entre envios; renovada a cada _WS_TTL (token OAuth dura ~1h)
+_WS_TTL = 3000
+_ws_ts = 0.0
+
+@functools.lru_cache(maxsize=1)
+def _cached_worksheet():
+    global _ws_ts
+    _ws_ts = time.time()
+    return _open_worksheet()
+
+def _get_ws():
+    if time.time() - _ws_ts > _WS_TTL:
+        _cached_worksheet.cache_clear()
+    return _cached_worksheet()
+
+def _append_rows_to_gsheet(rows):
+    """append_rows na aba em cache.
+
+    append_rows não é idempotente: só repete (com a aba reaberta) quando o Google recusou a
+    chamada por autenticação (401/403, token expirado), caso em que nada foi gravado.
+    Qualquer outra falha (timeout, conexão caída...) limpa o cache e propaga, sem reenviar.
+    """
+    for attempt in (1, 2):
+        ws = _get_ws()
+        if ws is None:
+            return
+        from gspread.exceptions import APIError  # há aba, então o gspread está disponível
         try:
-            ws = sh.sheet1
+            ws.append_rows(rows, value_input_option="USER_ENTERED")
+            return
+        except APIError as e:
+            _cached_worksheet.cache_clear()
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if attempt == 2 or status not in (401, 403):
+                raise
         except Exception:
-            # fallback caso a ordem de abas tenha mudado
-            ws = sh.get_worksheet(0)
+            _cached_worksheet.cache_clear()
+            raise
 
-        print("✅ Aba selecionada:", ws.title)
-        ws.append_row(row, value_input_option="USER_ENTERED")
-        print("✅ Linha adicionada:", row)
+def _append_to_gsheet(row):
+    """Adiciona uma linha no Google Sheets na hora (usado pelo /test_gsheet)."""
+    try:
+        _append_rows_to_gsheet([row])
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("✅ Linha adicionada: %s", row)
 
     except Exception as e:
-        import traceback
-        print("❌ ERRO AO ESCREVER NA PLANILHA:", repr(e))
-        traceback.print_exc()
+        log.exception("❌ ERRO AO ESCREVER NA PLANILHA: %r", e)
+
 
+# Fila de linhas para o Google Sheets, drenada em lotes por _sheets_worker (fora das requisições)
+# Um lote fecha com SHEETS_BATCH_MAX linhas ou SHEETS_FLUSH_SECONDS após a primeira linha.
+# Janela curta: pedido fica pouco tempo só em memória e o ritmo baixo rende até 50 escritas/100 s
+# (metade da cota do Sheets); no shutdown a janela é encerrada na hora (_SHEETS_STOP).
+SHEETS_QUEUE: asyncio.Queue = asyncio.Queue()
+SHEETS_BATCH_MAX = 50
+SHEETS_FLUSH_SECONDS = 2.0
+SHEETS_SHUTDOWN_TIMEOUT = 10.0  # tempo máximo para esvaziar a fila no shutdown
+_SHEETS_STOP = object()  # sentinela: o worker envia o que tem e termina
+_sheets_task: Optional[asyncio.Task] = None
 
+async def _flush_sheets(batch: list):
+    try:
+        await run_in_threadpool(_append_rows_to_gsheet, batch)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("✅ Linhas adicionadas: %d", len(batch))
+    except Exception as e:
+        log.exception("❌ ERRO AO ESCREVER NA PLANILHA (%d linhas perdidas: %r): %r", len(batch), batch, e)
+
+async def _sheets_worker():
+    """Drena SHEETS_QUEUE e envia cada lote com um único append_rows (uma chamada HTTPS).
+
+    Ao receber _SHEETS_STOP, envia o lote em andamento e o resto da fila antes de sair.
+    Se for cancelado no meio (timeout do shutdown), loga as linhas que não chegaram a ir.
+    """
+    loop = asyncio.get_running_loop()
+    pending: list = []  # linhas ainda não enviadas
+    stopping = False
+    try:
+        while not stopping:
+            row = await SHEETS_QUEUE.get()
+            if row is _SHEETS_STOP:
+                break
+            pending = [row]
+            deadline = loop.time() + SHEETS_FLUSH_SECONDS
+            while len(pending) < SHEETS_BATCH_MAX:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(SHEETS_QUEUE.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if row is _SHEETS_STOP:
+                    stopping = True
+                    break
+                pending.append(row)
+            await _flush_sheets(pending)
+            pending = []
+
+        # Shutdown: o que ainda estiver na fila vai em lotes, sem esperar a janela
+        while not SHEETS_QUEUE.empty():
+            row = SHEETS_QUEUE.get_nowait()
+            if row is not _SHEETS_STOP:
+                pending.append(row)
+        while pending:
+            await _flush_sheets(pending[:SHEETS_BATCH_MAX])
+            pending = pending[SHEETS_BATCH_MAX:]
+    except asyncio.CancelledError:
+        while not SHEETS_QUEUE.empty():
+            row = SHEETS_QUEUE.get_nowait()
+            if row is not _SHEETS_STOP:
+                pending.append(row)
+        if pending:
+            log.error("❌ Shutdown: %d linhas podem não ter chegado ao Google Sheets: %r", len(pending), pending)
+        raise
 
 def _append_to_gsheet_safe(order_id: int, payload, db_products: dict, total: float, entrega: str | None):
-    """Prepara e envia o pedido para o Google Sheets"""
+    """Prepara o pedido e o enfileira para o Google Sheets"""
     try:
-        items_join = "; ".join([f"{db_products[it.id][0]} x{it.qty}" for it in payload.items])
-        _append_to_gsheet([
+        items_join = "; ".join(f"{db_products[it.id][0]} x{it.qty}" for it in payload.items)
+        SHEETS_QUEUE.put_nowait([
             order_id,
             payload.customer.nome,
             payload.customer.telefone,
@@ -274,90 +615,97 @@ def _append_to_gsheet_safe(order_id: int, payload, db_products: dict, total: flo
             items_join
         ])
     except Exception as e:
-        print("GSHEETS APPEND ERROR:", e)
+        log.error("GSHEETS APPEND ERROR: %s", e)
 
 
 
 
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
-def require_admin(x_admin_token: Optional[str] = Header(None)) -> bool:
-    return bool(ADMIN_TOKEN) and (x_admin_token == ADMIN_TOKEN)
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependência das rotas admin: 401 sem o X-Admin-Token correto."""
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail=_ERR_UNAUTHORIZED)
 
-# Versão segura de /orders (sem GROUP_CONCAT)
-@app.get("/orders")
-def list_orders(x_admin_token: Optional[str] = Header(None), limit: int = 200):
-    if not require_admin(x_admin_token):
-        return {"error": "unauthorized"}
-    try:
-        rows = cur.execute(
-            "SELECT id, customer_name, customer_phone, customer_address, total, mode, "
-            "COALESCE(delivery_date,''), COALESCE(status,'pending') "
-            "FROM orders ORDER BY id DESC LIMIT ?", (limit,)
-        ).fetchall()
-
-        orders = []
-        for r in rows:
-            oid, name, phone, addr, total, mode, delivery_date, status = r
-            items_rows = cur.execute(
-                "SELECT p.name, i.qty FROM order_items i "
-                "JOIN products p ON p.id = i.product_id WHERE i.order_id = ?",
-                (oid,)
-            ).fetchall()
-            items = "; ".join([f"{n} x{q}" for n, q in items_rows]) if items_rows else ""
-            orders.append({
-                "id": oid,
-                "customer_name": name,
-                "customer_phone": phone,
-                "customer_address": addr,
-                "total": total,
-                "mode": mode,
-                "delivery_date": delivery_date,
-                "status": status or "pending",
-                "items": items,
-            })
-        return orders
-    except Exception as e:
-        return {"error": "server", "detail": str(e)}
-
-@app.get("/orders.csv")
-def export_orders_csv(x_admin_token: Optional[str] = Header(None), limit: int = 1000):
-    if not require_admin(x_admin_token):
-        return {"error": "unauthorized"}
-    try:
-        rows = cur.execute(
-            "SELECT id, customer_name, customer_phone, customer_address, total, mode, "
-            "COALESCE(delivery_date,''), COALESCE(status,'pending') "
-            "FROM orders ORDER BY id DESC LIMIT ?", (limit,)
-        ).fetchall()
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["id","customer_name","customer_phone","customer_address",
-                         "total","mode","delivery_date","status","items"])
-        for r in rows:
-            oid, name, phone, addr, total, mode, delivery_date, status = r
-            items_rows = cur.execute(
-                "SELECT p.name, i.qty FROM order_items i "
-                "JOIN products p ON p.id = i.product_id WHERE i.order_id = ?",
-                (oid,)
-            ).fetchall()
-            items = "; ".join([f"{n} x{q}" for n, q in items_rows]) if items_rows else ""
-            writer.writerow([oid, name, phone, addr, total, mode, delivery_date, status or "pending", items])
-        return output.getvalue()
-    except Exception as e:
-        return {"error": "server", "detail": str(e)}
+# Pedidos recentes com itens agregados: limita aos N últimos pedidos ANTES do JOIN,
+# então o custo é O(limit × itens por pedido) e não O(todos os pedidos)
+_RECENT_ORDERS_SQL = """
+WITH recent AS (
+  SELECT * FROM orders ORDER BY id DESC LIMIT ?
+)
+SELECT r.id AS id, r.customer_name AS customer_name, r.customer_phone AS customer_phone,
+       r.customer_address AS customer_address, r.total AS total, r.mode AS mode,
+       COALESCE(r.delivery_date,'') AS delivery_date,
+       COALESCE(NULLIF(r.status,''),'pending') AS status,
+       COALESCE(GROUP_CONCAT(p.name || ' x' || i.qty, '; '), '') AS items
+FROM recent r
+LEFT JOIN order_items i ON i.order_id = r.id
+LEFT JOIN products p ON p.id = i.product_id
+GROUP BY r.id
+ORDER BY r.id DESC
+"""
+_UPDATE_STATUS_SQL = "UPDATE orders SET status=? WHERE id=?"
+
+@app.get("/orders", dependencies=[Depends(require_admin)])
+async def list_orders(limit: int = 200):
+    # Sem cache em memória: com vários workers ele serviria status antigo; a CTE + índice
+    # já limitam a consulta aos `limit` pedidos mais recentes
+    async with pool.connection() as db:
+        async with db.execute(_RECENT_ORDERS_SQL, (limit,)) as cur:
+            rows = await cur.fetchall()
+    # Aliases do SELECT já são as chaves do JSON
+    return [dict(r) for r in rows]
+
+class _Echo:
+    """Destino para csv.writer: write() devolve a linha, então writerow() a retorna pronta."""
+    def write(self, value: str) -> str:
+        return value
+
+@app.get("/orders.csv", dependencies=[Depends(require_admin)])
+async def export_orders_csv(limit: int = 1000):
+    # Streaming: uma linha por vez direto do cursor, sem montar o CSV inteiro em memória
+    async def _gen():
+        writer = csv.writer(_Echo())
+        yield writer.writerow(["id","customer_name","customer_phone","customer_address",
+                               "total","mode","delivery_date","status","items"])
+        async with pool.connection() as db:
+            async with db.execute(_RECENT_ORDERS_SQL, (limit,)) as cur:
+                async for row in cur:
+                    yield writer.writerow(row)
+
+    return StreamingResponse(_gen(), media_type="text/csv",
+                             headers={"Content-Disposition": "attachment; filename=orders.csv"})
 
 class StatusIn(BaseModel):
     status: str  # 'done' ou 'pending'
 
-@app.post("/orders/{order_id}/status")
-def update_status(order_id: int, payload: StatusIn, x_admin_token: Optional[str] = Header(None)):
-    if not require_admin(x_admin_token):
-        return {"error": "unauthorized"}
+class BulkStatusIn(BaseModel):
+    ids: List[int]
+    status: str  # 'done' ou 'pending'
+
+# Atualização em lote do admin: um único UPDATE ... IN (...) para N pedidos
+@app.post("/orders/status/bulk", dependencies=[Depends(require_admin)])
+async def update_status_bulk(payload: BulkStatusIn):
+    if payload.status not in ("done", "pending"):
+        return _err(_ERR_INVALID_STATUS)
+    ids = list(dict.fromkeys(payload.ids))
+    if not ids or len(ids) > MAX_BULK_IDS:
+        return _err(_ERR_INVALID_IDS)
+    async with pool.connection() as db:
+        # Um só statement: atômico em autocommit, um commit só
+        cur = await db.execute(
+            f"UPDATE orders SET status=? WHERE id IN ({','.join('?' * len(ids))})",
+            (payload.status, *ids))
+        updated = cur.rowcount
+        await cur.close()
+    return {"ok": True, "ids": ids, "status": payload.status, "updated": updated}
+
+@app.post("/orders/{order_id}/status", dependencies=[Depends(require_admin)])
+async def update_status(order_id: int, payload: StatusIn):
     if payload.status not in ("done", "pending"):
-        return {"error": "invalid status"}
-    cur.execute("UPDATE orders SET status=? WHERE id=?", (payload.status, order_id))
-    conn.commit()
+        return _err(_ERR_INVALID_STATUS)
+    async with pool.connection() as db:
+        await db.execute(_UPDATE_STATUS_SQL, (payload.status, order_id))
     return {"ok": True, "id": order_id, "status": payload.status}
 
 @app.get("/test_gsheet")
@@ -366,27 +714,18 @@ def test_gsheet():
     try:
         row = ["TESTE", datetime.datetime.now().isoformat()]
         _append_to_gsheet(row)
-        print("✅ TESTE enviado ao Google Sheets:", row)
+        log.debug("✅ TESTE enviado ao Google Sheets: %s", row)
         return {"ok": True, "msg": "Linha de teste enviada", "row": row}
     except Exception as e:
-        print("GSHEETS TEST ERROR:", e)
+        log.error("GSHEETS TEST ERROR: %s", e)
         return {"error": str(e)}
 @app.get("/gsdebug")
 def gsdebug():
     try:
-        from google.oauth2.service_account import Credentials
         import gspread
-        info = json.loads(GOOGLE_SERVICE_ACCOUNT_JSON.strip())
-        # Normaliza PK aqui também
-        pk = info.get("private_key", "")
-        if isinstance(pk, str):
-            pk = pk.replace("\\r\\n", "\n").replace("\\n", "\n").replace("\r\n", "\n")
-            info["private_key"] = pk
-
-        creds = Credentials.from_service_account_info(
-            info, scopes=["https://www.googleapis.com/auth/spreadsheets"]
-        )
-        gc = gspread.authorize(creds)
+        if _CREDS is None:
+            return {"ok": False, "error": "Missing or invalid credentials."}
+        gc = gspread.authorize(_CREDS)
         sh = gc.open_by_key(GOOGLE_SHEETS_ID)
         sheets = [ws.title for ws in sh.worksheets()]
         return {"ok": True, "spreadsheet_title": sh.title, "tabs": sheets}
@@ -395,7 +734,6 @@ def gsdebug():
 
 @app.get("/envcheck")
 def envcheck():
-    import os, json
     try:
         info = json.loads(os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON", "{}"))
         return {